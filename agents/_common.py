@@ -0,0 +1,75 @@
+"""
+Shared helpers for the LLM agents
+"""
+import hashlib
+import logging
+import os
+import time
+from functools import lru_cache
+from typing import Optional
+
+import httpx
+from anthropic import AsyncAnthropic
+
+logger = logging.getLogger(__name__)
+
+# Prefill cost is linear in prompt length; cap the dynamic block so a
+# pathological upstream payload cannot cause a multi-second prefill.
+MAX_DATA_BLOCK_TOKENS = 2000
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate (~4 chars/token); avoids an extra API round-trip."""
+    return len(text) // 4 + 1
+
+
+def cap_data_block(data_block: str) -> str:
+    """Truncate a dynamic prompt block that exceeds the token budget."""
+    if estimate_tokens(data_block) <= MAX_DATA_BLOCK_TOKENS:
+        return data_block
+    logger.warning(
+        "Prompt data block truncated: ~%d tokens exceeds budget of %d",
+        estimate_tokens(data_block), MAX_DATA_BLOCK_TOKENS,
+    )
+    return data_block[: MAX_DATA_BLOCK_TOKENS * 4]
+
+
+# Short-TTL memo of parsed LLM results keyed by prompt hash. Prices tick
+# seconds apart while pollers hit the pipeline far more often, so an
+# identical payload within the window skips the whole prefill+decode.
+_LLM_CACHE_TTL = 60.0
+_LLM_CACHE_MAX = 64
+_llm_cache: dict = {}  # key -> (expires_at, result)
+
+
+def _llm_cache_key(prompt: str) -> bytes:
+    return hashlib.blake2b(prompt.encode(), digest_size=16).digest()
+
+
+def llm_cache_get(prompt: str) -> Optional[dict]:
+    """Return the cached result for an identical prompt, if still fresh."""
+    entry = _llm_cache.get(_llm_cache_key(prompt))
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+
+def llm_cache_put(prompt: str, result: dict) -> None:
+    """Cache a parsed LLM result, evicting the stalest entry at capacity."""
+    if len(_llm_cache) >= _LLM_CACHE_MAX:
+        del _llm_cache[min(_llm_cache, key=lambda k: _llm_cache[k][0])]
+    _llm_cache[_llm_cache_key(prompt)] = (time.monotonic() + _LLM_CACHE_TTL, result)
+
+
+@lru_cache(maxsize=1)
+def get_client() -> AsyncAnthropic:
+    """Get the shared async Anthropic client (reuses one connection pool).
+
+    An explicit timeout and retry budget keep one stalled connection from
+    hanging an agent call indefinitely.
+    """
+    return AsyncAnthropic(
+        api_key=os.getenv("ANTHROPIC_API_KEY"),
+        timeout=httpx.Timeout(30.0, connect=5.0),
+        max_retries=2,
+    )
@@ -1,62 +1,60 @@
 """
 Advisory Agent - Provides trade recommendations based on analysis
 """
-import os
-import json
-from anthropic import Anthropic
+import asyncio
 from typing import Optional
 
+from agents._common import cap_data_block, get_client, llm_cache_get, llm_cache_put
 
-def get_client() -> Anthropic:
-    """Get Anthropic client"""
-    return Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
 
+SYMBOLS = ("BTC", "ETH", "SOL")
 
-async def get_recommendations(monitor_data: dict, analysis_data: dict) -> dict:
-    """Generate trade recommendations based on market data and analysis"""
-    client = get_client()
+_COIN_ANALYSIS_KEYS = (("BTC", "btc_analysis"), ("ETH", "eth_analysis"), ("SOL", "sol_analysis"))
+
+# Per-symbol data block template precompiled once at import
+_SYMBOL_DATA_BLOCK = (
+    "SYMBOL: {symbol}\n"
+    "CURRENT PRICE: ${price:,.2f}\n"
+    "\n"
+    "MARKET ANALYSIS:\n"
+    "{analysis}"
+).format
+
+
+def _format_analysis(analysis: dict) -> str:
+    """Format the analysis dict as compact key: value lines.
+
+    Dumping the raw dict as indented JSON roughly 5x'd the token count of
+    this prompt section; only the fields the rules reference are kept.
+    """
+    _g = analysis.get
+    lines = [
+        f"- sentiment: {_g('market_sentiment', 'neutral')} "
+        f"(score {_g('sentiment_score', 0)})",
+        f"- risk_level: {_g('risk_level', 'medium')}",
+    ]
+    for symbol, key in _COIN_ANALYSIS_KEYS:
+        coin = _g(key)
+        if isinstance(coin, dict):
+            _cg = coin.get
+            factors = ", ".join(_cg("key_factors", [])[:3])
+            lines.append(
+                f"- {symbol}: trend {_cg('trend', 'sideways')}, "
+                f"{_cg('strength', 'moderate')}"
+                + (f" ({factors})" if factors else "")
+            )
+    summary = _g("market_summary")
+    if summary:
+        lines.append(f"- summary: {summary}")
+    return "\n".join(lines)
 
-    prices = monitor_data.get("prices", {})
 
-    prompt = f"""You are a crypto trading advisor for paper trading (simulated trades only - no real money).
-Based on the market analysis, provide trade recommendations for BTC, ETH, and SOL perpetual futures.
-
-CURRENT PRICES:
-- BTC: ${prices.get('BTC', {}).get('price', 0):,.2f}
-- ETH: ${prices.get('ETH', {}).get('price', 0):,.2f}
-- SOL: ${prices.get('SOL', {}).get('price', 0):,.2f}
-
-MARKET ANALYSIS:
-{json.dumps(analysis_data, indent=2)}
-
-For each coin, provide a recommendation in this exact JSON format:
-{{
-    "recommendations": [
-        {{
-            "symbol": "BTC",
-            "action": "long" | "short" | "wait",
-            "confidence": <number 0-100>,
-            "leverage": <number 1-10>,
-            "entry_price": <current price or null if wait>,
-            "take_profit_price": <target price>,
-            "take_profit_percent": <percent gain>,
-            "stop_loss_price": <stop price>,
-            "stop_loss_percent": <percent loss>,
-            "reasoning": "<brief explanation>",
-            "risk_reward_ratio": <number>
-        }},
-        {{
-            "symbol": "ETH",
-            ...
-        }},
-        {{
-            "symbol": "SOL",
-            ...
-        }}
-    ],
-    "overall_market_stance": "aggressive" | "moderate" | "conservative" | "avoid",
-    "portfolio_advice": "<brief overall advice>"
-}}
+# Static prompt prefix, byte-identical across every per-symbol call and
+# kept separate from the data block. Rules plus tool schema sit well
+# under the 1024-token minimum Sonnet needs for Anthropic prompt
+# caching, so no cache_control breakpoint.
+_ADVISORY_RULES = """You are a crypto trading advisor for paper trading (simulated trades only - no real money).
+Based on the market analysis that follows, provide a trade recommendation for the given symbol's perpetual future using the record_recommendation tool.
 
 Rules:
 - Only recommend leverage 1-3x for low confidence (<50)
@@ -64,31 +62,120 @@ Rules:
 - Allow leverage 7-10x only for high confidence (>75)
 - Risk/reward ratio should be at least 1.5
 - Set reasonable take profit (2-15%) and stop loss (1-10%) based on volatility
-- If market is too risky, recommend "wait" with null prices
+- If market is too risky, recommend "wait" with null prices"""
 
-Respond ONLY with the JSON, no other text."""
+# Tool schema replaces the free-text JSON instructions: the API returns
+# the recommendation as an already-parsed dict, so there is no
+# fence-stripping or JSONDecodeError path.
+_RECOMMENDATION_TOOL = {
+    "name": "record_recommendation",
+    "description": "Record the trade recommendation for the symbol",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "symbol": {"type": "string"},
+            "action": {"type": "string", "enum": ["long", "short", "wait"]},
+            "confidence": {"type": "number", "minimum": 0, "maximum": 100},
+            "leverage": {"type": "number", "minimum": 1, "maximum": 10},
+            "entry_price": {"type": ["number", "null"], "description": "current price, or null if wait"},
+            "take_profit_price": {"type": ["number", "null"]},
+            "take_profit_percent": {"type": ["number", "null"]},
+            "stop_loss_price": {"type": ["number", "null"]},
+            "stop_loss_percent": {"type": ["number", "null"]},
+            "reasoning": {"type": "string", "description": "brief explanation"},
+            "risk_reward_ratio": {"type": ["number", "null"]},
+        },
+        "required": ["symbol", "action", "confidence", "leverage", "reasoning"],
+    },
+}
+
+# Single source of truth for the unhappy-path response shape
+_ADVISORY_FALLBACK_BASE = {
+    "recommendations": [],
+    "overall_market_stance": "avoid",
+    "portfolio_advice": "Could not generate recommendations. Please try again.",
+}
+
+
+async def _recommend_symbol(symbol: str, price: float, analysis_block: str) -> Optional[dict]:
+    """Ask Claude for a single symbol's recommendation; None on parse failure."""
+    client = get_client()
+
+    data_block = cap_data_block(
+        _SYMBOL_DATA_BLOCK(symbol=symbol, price=price, analysis=analysis_block)
+    )
 
-    response = client.messages.create(
+    # The block embeds symbol and price, so any tick naturally misses
+    cached = llm_cache_get(data_block)
+    if cached is not None:
+        return cached
+
+    response = await client.messages.create(
         model="claude-sonnet-4-20250514",
-        max_tokens=2048,
-        messages=[{"role": "user", "content": prompt}]
+        max_tokens=400,
+        tools=[_RECOMMENDATION_TOOL],
+        tool_choice={"type": "tool", "name": "record_recommendation"},
+        messages=[{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": _ADVISORY_RULES},
+                {"type": "text", "text": data_block},
+            ],
+        }]
     )
 
-    response_text = response.content[0].text.strip()
-
-    # Parse JSON from response
-    try:
-        if response_text.startswith("```"):
-            response_text = response_text.split("```")[1]
-            if response_text.startswith("json"):
-                response_text = response_text[4:]
-        recommendations = json.loads(response_text)
-    except json.JSONDecodeError:
-        recommendations = {
-            "recommendations": [],
-            "overall_market_stance": "avoid",
-            "portfolio_advice": "Could not generate recommendations. Please try again.",
-            "error": "Could not parse structured response"
-        }
-
-    return recommendations
+    # The forced tool call arrives already parsed
+    for block in response.content:
+        if block.type == "tool_use":
+            recommendation = block.input
+            recommendation.setdefault("symbol", symbol)
+            llm_cache_put(data_block, recommendation)
+            return recommendation
+    return None
+
+
+def _overall_stance(recommendations: list) -> str:
+    """Derive the portfolio stance from the per-symbol confidences."""
+    active = [r for r in recommendations if r.get("action") in ("long", "short")]
+    if not active:
+        return "avoid"
+    avg_confidence = sum(r.get("confidence", 0) for r in active) / len(active)
+    if avg_confidence > 75:
+        return "aggressive"
+    if avg_confidence >= 50:
+        return "moderate"
+    return "conservative"
+
+
+async def get_recommendations(monitor_data: dict, analysis_data: dict) -> dict:
+    """Generate trade recommendations based on market data and analysis.
+
+    Each symbol gets its own LLM call run concurrently: decode is
+    per-token, so three short completions in parallel finish in roughly
+    the wall-clock of one, versus one 3x-length monolithic completion.
+    """
+    prices = monitor_data.get("prices", {})
+    analysis_block = _format_analysis(analysis_data)
+
+    # Flatten the nested price dicts once instead of chaining .get per use
+    price_by_symbol = {
+        symbol: float(prices.get(symbol, {}).get("price", 0) or 0)
+        for symbol in SYMBOLS
+    }
+
+    results = await asyncio.gather(*[
+        _recommend_symbol(symbol, price_by_symbol[symbol], analysis_block)
+        for symbol in SYMBOLS
+    ])
+
+    recommendations = [r for r in results if r is not None]
+    if not recommendations:
+        return {**_ADVISORY_FALLBACK_BASE, "error": "Model did not return structured recommendations"}
+
+    stance = _overall_stance(recommendations)
+    active = sum(1 for r in recommendations if r.get("action") in ("long", "short"))
+    return {
+        "recommendations": recommendations,
+        "overall_market_stance": stance,
+        "portfolio_advice": f"{active} of {len(recommendations)} symbols have an active setup; stance is {stance}."
+    }
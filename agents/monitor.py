@@ -1,7 +1,11 @@
 """
 Monitor Agent - Fetches crypto prices, news, and market data
 """
+import asyncio
+import random
+import time
 import httpx
+import orjson
 from datetime import datetime
 from typing import Optional
 
@@ -12,22 +16,80 @@ COINS = {
     "solana": "SOL"
 }
 
+# One shared client for all monitor fetches: keep-alive + HTTP/2 avoid a
+# fresh TCP+TLS handshake to CoinGecko on every call.
+_CLIENT = httpx.AsyncClient(
+    http2=True,
+    timeout=8.0,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+)
 
-async def get_prices() -> dict:
-    """Fetch current prices from CoinGecko (free, no API key needed)"""
-    url = "https://api.coingecko.com/api/v3/simple/price"
-    params = {
+
+async def close_monitor_client():
+    """Close the shared HTTP client (wired into app shutdown)."""
+    await _CLIENT.aclose()
+
+
+# Fixed endpoints, percent-encoded once at import instead of per call
+_PRICES_URL = httpx.URL(
+    "https://api.coingecko.com/api/v3/simple/price",
+    params={
         "ids": "bitcoin,ethereum,solana",
         "vs_currencies": "usd",
         "include_24hr_change": "true",
         "include_24hr_vol": "true",
         "include_market_cap": "true"
-    }
+    },
+)
+_GLOBAL_URL = httpx.URL("https://api.coingecko.com/api/v3/global")
+_TRENDING_URL = httpx.URL("https://api.coingecko.com/api/v3/search/trending")
+
+
+# Conditional-GET cache: CoinGecko sends ETags, so an unchanged payload
+# costs a ~200-byte 304 round-trip with no body to download or parse.
+# Bounded because history keys include the client-supplied days param;
+# without a cap each distinct value would pin a payload forever.
+_ETAG_CACHE_MAX = 32
+_etags: dict = {}  # url key -> (etag, parsed payload)
+
+
+# CoinGecko's free tier rate-limits aggressively; cap our concurrency
+# and back off with jitter on 429/503 instead of failing the whole cycle.
+_FETCH_SEM = asyncio.Semaphore(4)
+_MAX_RETRIES = 4
+
+
+async def _get_json(url, params: Optional[dict] = None):
+    """GET a JSON payload, revalidating with If-None-Match when possible."""
+    key = f"{url}|{params}"
+    cached = _etags.get(key)
+    headers = {"if-none-match": cached[0]} if cached else None
+
+    for attempt in range(_MAX_RETRIES + 1):
+        async with _FETCH_SEM:
+            response = await _CLIENT.get(url, params=params, headers=headers)
+        if response.status_code in (429, 503) and attempt < _MAX_RETRIES:
+            await asyncio.sleep(min(60, 2 ** attempt) + random.uniform(0, 1))
+            continue
+        break
+
+    if response.status_code == 304 and cached:
+        return cached[1]
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+
+    etag = response.headers.get("etag")
+    if etag:
+        if key not in _etags and len(_etags) >= _ETAG_CACHE_MAX:
+            # Insertion order doubles as age: drop the oldest entry
+            del _etags[next(iter(_etags))]
+        _etags[key] = (etag, data)
+    return data
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
+
+async def get_prices() -> dict:
+    """Fetch current prices from CoinGecko (free, no API key needed)"""
+    data = await _get_json(_PRICES_URL)
 
     result = {}
     for coin_id, symbol in COINS.items():
@@ -44,18 +106,19 @@ async def get_prices() -> dict:
 
 async def get_market_data() -> dict:
     """Fetch detailed market data including fear/greed approximation"""
-    url = "https://api.coingecko.com/api/v3/global"
+    data = (await _get_json(_GLOBAL_URL))["data"]
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        response.raise_for_status()
-        data = response.json()["data"]
+    # Bind the nested dicts once: .get(..., {}) default-args allocate a
+    # throwaway dict per lookup and walk the chain twice
+    market_cap = data.get("total_market_cap") or {}
+    volume = data.get("total_volume") or {}
+    dominance = data.get("market_cap_percentage") or {}
 
     return {
-        "total_market_cap": data.get("total_market_cap", {}).get("usd", 0),
-        "total_volume": data.get("total_volume", {}).get("usd", 0),
-        "btc_dominance": data.get("market_cap_percentage", {}).get("btc", 0),
-        "eth_dominance": data.get("market_cap_percentage", {}).get("eth", 0),
+        "total_market_cap": market_cap.get("usd", 0),
+        "total_volume": volume.get("usd", 0),
+        "btc_dominance": dominance.get("btc", 0),
+        "eth_dominance": dominance.get("eth", 0),
         "market_cap_change_24h": data.get("market_cap_change_percentage_24h_usd", 0)
     }
 
@@ -63,12 +126,7 @@ async def get_market_data() -> dict:
 async def get_news() -> list:
     """Fetch crypto news from CoinGecko status updates (free)"""
     # Using CoinGecko's trending endpoint as a proxy for market interest
-    url = "https://api.coingecko.com/api/v3/search/trending"
-
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        response.raise_for_status()
-        data = response.json()
+    data = await _get_json(_TRENDING_URL)
 
     trending = []
     for item in data.get("coins", [])[:5]:
@@ -83,51 +141,99 @@ async def get_news() -> list:
     return trending
 
 
-async def get_price_history(coin_id: str = "bitcoin", days: int = 7) -> list:
-    """Fetch price history for charting"""
-    url = f"https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart"
-    params = {
-        "vs_currency": "usd",
-        "days": days
-    }
+# History cache: CoinGecko's multi-day market_chart data is hourly
+# granularity, so anything fresher than an hour is identical upstream.
+# The per-key lock keeps concurrent misses from stampeding CoinGecko.
+_HISTORY_TTL = 3600.0
+_HISTORY_CACHE_MAX = 32
+_history_cache: dict = {}  # (coin_id, days) -> (fetched_at, prices)
+_history_locks: dict = {}  # (coin_id, days) -> asyncio.Lock
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
 
-    prices = []
-    for item in data.get("prices", []):
-        prices.append({
-            "timestamp": item[0],
-            "price": item[1]
-        })
+async def get_price_history(coin_id: str = "bitcoin", days: int = 7) -> list:
+    """Fetch price history for charting (cached for 1h per coin/window)"""
+    key = (coin_id, days)
+    cached = _history_cache.get(key)
+    if cached and time.monotonic() - cached[0] < _HISTORY_TTL:
+        return cached[1]
+
+    lock = _history_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        # Another coroutine may have fetched while we waited
+        cached = _history_cache.get(key)
+        if cached and time.monotonic() - cached[0] < _HISTORY_TTL:
+            return cached[1]
+
+        url = f"https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart"
+        params = {
+            "vs_currency": "usd",
+            "days": days
+        }
+
+        data = await _get_json(url, params=params)
+
+        prices = [
+            {"timestamp": item[0], "price": item[1]}
+            for item in data.get("prices", [])
+        ]
+
+        if len(_history_cache) >= _HISTORY_CACHE_MAX:
+            oldest = min(_history_cache, key=lambda k: _history_cache[k][0])
+            del _history_cache[oldest]
+            _history_locks.pop(oldest, None)
+        _history_cache[key] = (time.monotonic(), prices)
 
     return prices
 
 
-async def run_monitor() -> dict:
-    """Run the full monitor agent and return all data"""
-    timestamp = datetime.utcnow().isoformat()
-
-    try:
-        prices = await get_prices()
-    except Exception as e:
-        prices = {"error": str(e)}
-
-    try:
-        market = await get_market_data()
-    except Exception as e:
-        market = {"error": str(e)}
+# Whole-bundle TTL cache: five endpoints funnel through run_monitor and
+# dashboard refreshes repeat far faster than market data moves. The LLM
+# stages key off this bundle, so a cache hit here also reuses their memos.
+_MONITOR_TTL = 30.0
+_monitor_cache = None  # (fetched_at, bundle)
+_monitor_lock = asyncio.Lock()  # single-flight guard for cold-cache refills
 
-    try:
-        trending = await get_news()
-    except Exception as e:
-        trending = {"error": str(e)}
 
-    return {
-        "timestamp": timestamp,
-        "prices": prices,
-        "market": market,
-        "trending": trending
-    }
+async def run_monitor() -> dict:
+    """Run the full monitor agent and return all data (cached for 30s).
+
+    The fetches are independent, so they run concurrently: wall time is
+    the slowest round-trip instead of the sum of all three. Concurrent
+    callers on a cold cache share one refill via the lock, so upstream
+    load stays flat no matter how many requests arrive at once.
+    """
+    global _monitor_cache
+    cached = _monitor_cache
+    if cached and time.monotonic() - cached[0] < _MONITOR_TTL:
+        return cached[1]
+
+    async with _monitor_lock:
+        # Another caller may have refilled while we waited
+        cached = _monitor_cache
+        if cached and time.monotonic() - cached[0] < _MONITOR_TTL:
+            return cached[1]
+
+        timestamp = datetime.utcnow().isoformat()
+
+        prices, market, trending = await asyncio.gather(
+            get_prices(),
+            get_market_data(),
+            get_news(),
+            return_exceptions=True,
+        )
+
+        if isinstance(prices, BaseException):
+            prices = {"error": str(prices)}
+        if isinstance(market, BaseException):
+            market = {"error": str(market)}
+        if isinstance(trending, BaseException):
+            trending = {"error": str(trending)}
+
+        bundle = {
+            "timestamp": timestamp,
+            "prices": prices,
+            "market": market,
+            "trending": trending
+        }
+        _monitor_cache = (time.monotonic(), bundle)
+    return bundle
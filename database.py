@@ -1,49 +1,117 @@
 """
 database.py - PostgreSQL connection and schema initialization
 """
+import atexit
 import os
+import threading
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 from contextlib import contextmanager
 
+# The API only ever emits timestamps as ISO-8601 strings, so cast them
+# at decode time instead of building datetime objects every caller
+# immediately isoformat()s again. Postgres's text output differs from
+# ISO only by the space separator. OIDs: 1114 timestamp, 1184 timestamptz.
+_ISO_DATETIME = psycopg2.extensions.new_type(
+    (1114, 1184), "ISODATETIME",
+    lambda value, cur: value.replace(" ", "T") if value is not None else None
+)
+psycopg2.extensions.register_type(_ISO_DATETIME)
 
-def get_connection():
-    """Return a new psycopg2 connection using DATABASE_URL from environment."""
-    database_url = os.environ.get("DATABASE_URL")
-    if not database_url:
-        raise RuntimeError("DATABASE_URL environment variable is not set")
-    # Railway provides postgres:// URLs; psycopg2 requires postgresql://
-    if database_url.startswith("postgres://"):
-        database_url = database_url.replace("postgres://", "postgresql://", 1)
-    return psycopg2.connect(database_url)
+_MINCONN = 2
+_MAXCONN = 10
+
+_pool = None
+# ThreadedConnectionPool.getconn() raises PoolError the moment the pool
+# is empty; this gate makes the (up to 40) threadpool workers queue for
+# a connection instead of 500ing under burst load.
+_pool_gate = threading.BoundedSemaphore(_MAXCONN)
+
+
+def _get_pool():
+    """Return the shared connection pool, creating it on first use.
+
+    A fresh psycopg2.connect() per query paid a full TCP+TLS+auth
+    handshake each time; pooled connections are reused instead.
+    """
+    global _pool
+    if _pool is None:
+        database_url = os.environ.get("DATABASE_URL")
+        if not database_url:
+            raise RuntimeError("DATABASE_URL environment variable is not set")
+        # Railway provides postgres:// URLs; psycopg2 requires postgresql://
+        if database_url.startswith("postgres://"):
+            database_url = database_url.replace("postgres://", "postgresql://", 1)
+        _pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn=_MINCONN, maxconn=_MAXCONN, dsn=database_url
+        )
+        atexit.register(_pool.closeall)
+    return _pool
 
 
 @contextmanager
 def get_cursor():
     """
     Context manager that yields a RealDictCursor and handles
-    commit/rollback + connection close automatically.
+    commit/rollback + returning the connection to the pool.
 
     Usage:
         with get_cursor() as cur:
             cur.execute(...)
             rows = cur.fetchall()
     """
-    conn = get_connection()
-    try:
-        with conn:
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                yield cur
-    finally:
-        conn.close()
+    pool = _get_pool()
+    with _pool_gate:
+        conn = pool.getconn()
+        try:
+            with conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    yield cur
+        finally:
+            pool.putconn(conn)
+
+
+# Seed the single portfolio row if it does not yet exist
+_SEED_PORTFOLIO_SQL = """
+    INSERT INTO portfolio (id, balance, initial_balance,
+                           total_trades, winning_trades, losing_trades, total_pnl)
+    SELECT 1, 10000.0, 10000.0, 0, 0, 0, 0.0
+    WHERE NOT EXISTS (SELECT 1 FROM portfolio WHERE id = 1)
+"""
+
+# get_portfolio orders history by closed_at, and the trading paths
+# filter positions by symbol (existence checks, per-tick updates);
+# without these the planner sorts/scans whole tables. Runs on warm
+# boots too so existing deployments pick them up.
+_ENSURE_INDEXES_SQL = """
+    CREATE INDEX IF NOT EXISTS ix_trade_history_closed_at
+        ON trade_history (closed_at);
+    CREATE INDEX IF NOT EXISTS ix_positions_symbol
+        ON positions (symbol);
+    CREATE INDEX IF NOT EXISTS ix_trade_history_symbol_closed_at
+        ON trade_history (symbol, closed_at DESC);
+"""
 
 
 def init_db():
     """
     Create tables if they do not exist, then seed the portfolio row
     with default values if it is empty. Safe to call on every startup.
+
+    The schema check and DDL run as one script so startup costs a
+    couple of round-trips instead of one per statement.
     """
     with get_cursor() as cur:
+        cur.execute("SELECT to_regclass('portfolio') AS reg")
+        if cur.fetchone()["reg"] is not None:
+            # Schema already in place; just make sure the seed row and
+            # indexes exist
+            cur.execute(_SEED_PORTFOLIO_SQL + ";" + _ENSURE_INDEXES_SQL)
+            return
+
+        # One multi-statement script: psycopg2 sends it in a single
+        # round-trip, and the surrounding transaction makes it atomic
         cur.execute("""
             CREATE TABLE IF NOT EXISTS portfolio (
                 id              INTEGER PRIMARY KEY DEFAULT 1,
@@ -54,10 +122,8 @@ def init_db():
                 losing_trades   INTEGER          NOT NULL DEFAULT 0,
                 total_pnl       DOUBLE PRECISION NOT NULL DEFAULT 0.0,
                 CHECK (id = 1)
-            )
-        """)
+            );
 
-        cur.execute("""
             CREATE TABLE IF NOT EXISTS positions (
                 id                     SERIAL           PRIMARY KEY,
                 symbol                 VARCHAR(20)      NOT NULL,
@@ -74,10 +140,8 @@ def init_db():
                 opened_at              TIMESTAMPTZ      NOT NULL DEFAULT NOW(),
                 unrealized_pnl         DOUBLE PRECISION NOT NULL DEFAULT 0.0,
                 unrealized_pnl_percent DOUBLE PRECISION NOT NULL DEFAULT 0.0
-            )
-        """)
+            );
 
-        cur.execute("""
             CREATE TABLE IF NOT EXISTS trade_history (
                 id                     INTEGER          NOT NULL,
                 symbol                 VARCHAR(20)      NOT NULL,
@@ -101,13 +165,5 @@ def init_db():
                 close_reason           VARCHAR(50)      NOT NULL,
                 was_profitable         BOOLEAN          NOT NULL,
                 hit_target             BOOLEAN          NOT NULL
-            )
-        """)
-
-        # Seed the single portfolio row if it does not yet exist
-        cur.execute("""
-            INSERT INTO portfolio (id, balance, initial_balance,
-                                   total_trades, winning_trades, losing_trades, total_pnl)
-            SELECT 1, 10000.0, 10000.0, 0, 0, 0, 0.0
-            WHERE NOT EXISTS (SELECT 1 FROM portfolio WHERE id = 1)
-        """)
+            );
+        """ + _SEED_PORTFOLIO_SQL + ";" + _ENSURE_INDEXES_SQL)
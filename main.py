@@ -1,47 +1,129 @@
 """
 Crypto Agent System - Main FastAPI Application
 """
+import asyncio
+import hashlib
 import os
-from fastapi import FastAPI, HTTPException
+import orjson
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional
 
 # Load environment variables
 load_dotenv()
 
 # Import agents and trading system
-from agents.monitor import run_monitor, get_prices, get_price_history
-from agents.analysis import analyze_market
-from agents.advisory import get_recommendations
+from agents.monitor import run_monitor, get_prices, get_price_history, close_monitor_client
+from agents._common import get_client as get_anthropic_client
+from pipeline import run_analysis_pipeline, run_recommendation_pipeline
 import paper_trading
 from database import init_db
 
-app = FastAPI(title="Crypto Agent System", version="1.0.0")
+# SSE fan-out: one background refresh serves every connected dashboard
+# tab, instead of each tab polling /api/monitor on its own timer.
+_STREAM_INTERVAL = 15.0
+_stream_subscribers: set = set()  # asyncio.Queue per connected client
+
+
+async def _monitor_publisher():
+    """Refresh the monitor bundle periodically and fan it out to SSE clients."""
+    while True:
+        if _stream_subscribers:
+            try:
+                payload = orjson.dumps(await run_monitor())
+            except Exception:
+                payload = None
+            if payload is not None:
+                for queue in list(_stream_subscribers):
+                    # Drop the oldest snapshot for a stalled client rather
+                    # than blocking the publisher on its queue
+                    if queue.full():
+                        queue.get_nowait()
+                    queue.put_nowait(payload)
+        await asyncio.sleep(_STREAM_INTERVAL)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Set up the DB and SSE publisher; close shared clients on exit."""
+    init_db()
+    publisher = asyncio.create_task(_monitor_publisher())
+    yield
+    publisher.cancel()
+    await close_monitor_client()
+    await get_anthropic_client().close()
 
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database tables on startup"""
-    init_db()
+# orjson serializes the big nested monitor/execute payloads several
+# times faster than the stdlib encoder, and handles datetimes natively
+app = FastAPI(
+    title="Crypto Agent System",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
+
+class _GZipSkipStream(GZipMiddleware):
+    """GZip everything except the SSE stream.
+
+    Starlette's gzip responder never flushes the deflate buffer between
+    streamed chunks, so compressing /api/stream would leave events stuck
+    server-side until the connection closes.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/api/stream":
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# History and execute payloads compress 5-10x; small responses are left
+# alone so the header overhead doesn't exceed the savings
+app.add_middleware(_GZipSkipStream, minimum_size=1024, compresslevel=5)
 
 
 # Serve static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
-# Request models
+# Request models: extra='forbid' rejects typo'd fields instead of
+# silently validating past them, and frozen models skip the mutable
+# bookkeeping pydantic otherwise sets up per instance
 class ResetPortfolioRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     initial_balance: Optional[float] = 10000.0
 
 
 class ClosePositionRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     position_id: int
     close_price: float
 
 
+def _conditional_json(request: Request, payload) -> Response:
+    """Serve payload with an ETag, or a bare 304 when the client has it.
+
+    The dashboard polls the monitor endpoints on a timer and most polls
+    land inside the upstream TTL caches, so the payload is byte-identical;
+    a 304 skips re-sending (and the client re-parsing) kilobytes of JSON.
+    """
+    body = orjson.dumps(payload)
+    etag = '"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"etag": etag})
+    return Response(content=body, media_type="application/json",
+                    headers={"etag": etag})
+
+
 # Routes
 
 @app.get("/")
@@ -59,21 +141,21 @@ async def health_check():
 # Monitor Agent endpoints
 
 @app.get("/api/monitor")
-async def monitor():
+async def monitor(request: Request):
     """Run the monitor agent to fetch current market data"""
     try:
         data = await run_monitor()
-        return data
+        return _conditional_json(request, data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/prices")
-async def prices():
+async def prices(request: Request):
     """Get current prices only"""
     try:
         data = await get_prices()
-        return data
+        return _conditional_json(request, data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -91,20 +173,32 @@ async def price_history(coin_id: str, days: int = 7):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/stream")
+async def stream():
+    """Stream monitor snapshots over Server-Sent Events"""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=4)
+    _stream_subscribers.add(queue)
+
+    async def _gen():
+        try:
+            # Send the current bundle immediately so new clients don't
+            # wait out a publisher interval before first paint
+            yield b"data: " + orjson.dumps(await run_monitor()) + b"\n\n"
+            while True:
+                yield b"data: " + await queue.get() + b"\n\n"
+        finally:
+            _stream_subscribers.discard(queue)
+
+    return StreamingResponse(_gen(), media_type="text/event-stream")
+
+
 # Analysis Agent endpoint
 
 @app.get("/api/analyze")
 async def analyze():
     """Run monitor and analysis agents"""
     try:
-        # First get monitor data
-        monitor_data = await run_monitor()
-        # Then analyze it
-        analysis = await analyze_market(monitor_data)
-        return {
-            "monitor": monitor_data,
-            "analysis": analysis
-        }
+        return await run_analysis_pipeline()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -115,37 +209,31 @@ async def analyze():
 async def recommend():
     """Run all agents and get trade recommendations"""
     try:
-        # Get monitor data
-        monitor_data = await run_monitor()
-        # Analyze it
-        analysis = await analyze_market(monitor_data)
-        # Get recommendations
-        recommendations = await get_recommendations(monitor_data, analysis)
-        return {
-            "monitor": monitor_data,
-            "analysis": analysis,
-            "recommendations": recommendations
-        }
+        return await run_recommendation_pipeline()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # Paper Trading endpoints
 
+# paper_trading is blocking psycopg2 code; these handlers are plain
+# `def` so FastAPI runs them in its threadpool instead of stalling the
+# event loop (and every other request) on each query.
+
 @app.get("/api/portfolio")
-async def get_portfolio():
+def get_portfolio():
     """Get current paper trading portfolio"""
     return paper_trading.get_portfolio()
 
 
 @app.post("/api/portfolio/reset")
-async def reset_portfolio(request: ResetPortfolioRequest):
+def reset_portfolio(request: ResetPortfolioRequest):
     """Reset paper trading portfolio"""
     return paper_trading.reset_portfolio(request.initial_balance)
 
 
 @app.get("/api/portfolio/stats")
-async def get_stats():
+def get_stats():
     """Get performance statistics"""
     return paper_trading.get_performance_stats()
 
@@ -155,8 +243,8 @@ async def update_positions():
     """Update positions with current prices and check TP/SL"""
     try:
         current_prices = await get_prices()
-        closed = paper_trading.update_positions(current_prices)
-        portfolio = paper_trading.get_portfolio()
+        closed = await run_in_threadpool(paper_trading.update_positions, current_prices)
+        portfolio = await run_in_threadpool(paper_trading.get_portfolio)
         return {
             "closed_positions": closed,
             "portfolio": portfolio
@@ -166,7 +254,7 @@ async def update_positions():
 
 
 @app.post("/api/portfolio/close")
-async def close_position(request: ClosePositionRequest):
+def close_position(request: ClosePositionRequest):
     """Manually close a position"""
     result = paper_trading.close_position(
         request.position_id,
@@ -182,27 +270,23 @@ async def close_position(request: ClosePositionRequest):
 async def execute_recommendations():
     """Run all agents, get recommendations, and auto-execute trades"""
     try:
-        # Get monitor data
-        monitor_data = await run_monitor()
-        # Analyze it
-        analysis = await analyze_market(monitor_data)
-        # Get recommendations
-        recommendations = await get_recommendations(monitor_data, analysis)
-        # Auto-execute
-        current_prices = monitor_data.get("prices", {})
-        opened_positions = paper_trading.auto_execute_recommendations(
-            recommendations, current_prices
+        bundle = await run_recommendation_pipeline()
+        # Auto-execute, then update: both touch the positions table, so
+        # they stay sequential (update also marks freshly opened rows)
+        current_prices = bundle["monitor"].get("prices", {})
+        opened_positions = await run_in_threadpool(
+            paper_trading.auto_execute_recommendations,
+            bundle["recommendations"], current_prices
+        )
+        closed_positions = await run_in_threadpool(
+            paper_trading.update_positions, current_prices
         )
-        # Also update existing positions
-        closed_positions = paper_trading.update_positions(current_prices)
 
         return {
-            "monitor": monitor_data,
-            "analysis": analysis,
-            "recommendations": recommendations,
+            **bundle,
             "opened_positions": opened_positions,
             "closed_positions": closed_positions,
-            "portfolio": paper_trading.get_portfolio()
+            "portfolio": await run_in_threadpool(paper_trading.get_portfolio)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -2,31 +2,54 @@
 Paper Trading System - Simulated trading with fake money
 """
 import os
-from datetime import datetime
+import time
 from typing import Optional
+import psycopg2.extras
 from database import get_cursor
 
-
-def _row_to_position(row) -> dict:
-    """Convert a DB row to the dict format used by the API."""
-    d = dict(row)
-    for key in ("opened_at", "closed_at"):
-        if key in d and isinstance(d[key], datetime):
-            d[key] = d[key].isoformat()
-    return d
+# Stats are polled by the dashboard but only change when a position
+# opens or closes; a short TTL plus invalidation on every mutating path
+# turns most polls into a dict lookup instead of a query.
+_STATS_TTL = 5.0
+_stats_cache = None  # (fetched_at, stats)
+
+
+def _invalidate_stats_cache():
+    global _stats_cache
+    _stats_cache = None
+
+
+# trade_history grows without bound; the dashboard only renders recent
+# trades, and the stats come from the portfolio counters, not a scan
+_HISTORY_LIMIT = 100
+
+# One statement returns the portfolio row and both collections as JSON,
+# so a portfolio read costs one round-trip instead of three. Postgres
+# emits the timestamps as ISO strings, ready for the API.
+_PORTFOLIO_SQL = """
+    SELECT
+        (SELECT row_to_json(p) FROM portfolio p WHERE p.id = 1) AS port,
+        (SELECT COALESCE(json_agg(x ORDER BY x.id), '[]'::json)
+         FROM positions x)                                      AS positions,
+        (SELECT COALESCE(json_agg(h ORDER BY h.closed_at), '[]'::json)
+         FROM (SELECT id, symbol, direction, entry_price, close_price,
+                      leverage, opened_at, closed_at,
+                      realized_pnl, realized_pnl_percent,
+                      close_reason, was_profitable, hit_target
+               FROM trade_history
+               ORDER BY closed_at DESC LIMIT %s) h)             AS history
+"""
 
 
 def get_portfolio() -> dict:
-    """Get current portfolio status"""
+    """Get current portfolio status (history capped to the most recent trades)"""
     with get_cursor() as cur:
-        cur.execute("SELECT * FROM portfolio WHERE id = 1")
-        port = dict(cur.fetchone())
-
-        cur.execute("SELECT * FROM positions ORDER BY id")
-        positions = [_row_to_position(r) for r in cur.fetchall()]
+        cur.execute(_PORTFOLIO_SQL, (_HISTORY_LIMIT,))
+        row = cur.fetchone()
 
-        cur.execute("SELECT * FROM trade_history ORDER BY closed_at")
-        history = [_row_to_position(r) for r in cur.fetchall()]
+    port = row["port"]
+    positions = row["positions"]
+    history = row["history"]
 
     return {
         "balance": port["balance"],
@@ -58,6 +81,7 @@ def reset_portfolio(initial_balance: float = 10000.0) -> dict:
             WHERE id = 1
         """, (initial_balance, initial_balance))
 
+    _invalidate_stats_cache()
     return {
         "balance": initial_balance,
         "initial_balance": initial_balance,
@@ -92,198 +116,281 @@ def open_position(
         position_value = balance * (position_size_percent / 100)
         margin_used    = position_value
         position_size  = (position_value * leverage) / entry_price
-        opened_at      = datetime.utcnow()
 
+        # opened_at comes from the column's DEFAULT NOW(): the server
+        # clock is consistent across workers, unlike per-process utcnow()
         cur.execute("""
             INSERT INTO positions
                 (symbol, direction, entry_price, current_price, leverage,
                  position_size, margin_used, take_profit_price, stop_loss_price,
-                 confidence, reasoning, opened_at,
+                 confidence, reasoning,
                  unrealized_pnl, unrealized_pnl_percent)
             VALUES
                 (%s, %s, %s, %s, %s,
                  %s, %s, %s, %s,
-                 %s, %s, %s,
+                 %s, %s,
                  0.0, 0.0)
             RETURNING *
         """, (
             symbol, direction, entry_price, entry_price, leverage,
             position_size, margin_used, take_profit_price, stop_loss_price,
-            confidence, reasoning, opened_at
+            confidence, reasoning
         ))
-        position = _row_to_position(cur.fetchone())
+        position = cur.fetchone()
 
         cur.execute("""
             UPDATE portfolio SET balance = balance - %s WHERE id = 1
         """, (margin_used,))
 
+    _invalidate_stats_cache()
     return position
 
 
 def update_positions(current_prices: dict) -> list:
     """Update all positions with current prices and check for TP/SL"""
+    symbols = list(current_prices)
+    if not symbols:
+        return []
+
     with get_cursor() as cur:
-        cur.execute("SELECT * FROM positions")
-        positions = [_row_to_position(r) for r in cur.fetchall()]
+        # Only positions the price dict can actually update this tick
+        cur.execute("SELECT * FROM positions WHERE symbol = ANY(%s)", (symbols,))
+        positions = cur.fetchall()
 
-    closed_positions = []
+    to_close = []  # (position, close_price, reason)
+    marks = []     # (id, current_price, unrealized_pnl, unrealized_pnl_percent)
 
     for position in positions:
         symbol = position["symbol"]
-        if symbol not in current_prices:
-            continue
-
         current_price = current_prices[symbol].get("price", position["entry_price"])
 
-        # Calculate PnL
-        if position["direction"] == "long":
-            price_change_percent = ((current_price - position["entry_price"]) / position["entry_price"]) * 100
-        else:  # short
-            price_change_percent = ((position["entry_price"] - current_price) / position["entry_price"]) * 100
+        # Sign folds the long/short cases into one set of formulas
+        sign = 1.0 if position["direction"] == "long" else -1.0
 
+        price_change_percent  = sign * (current_price - position["entry_price"]) / position["entry_price"] * 100
         leveraged_pnl_percent = price_change_percent * position["leverage"]
         unrealized_pnl        = position["margin_used"] * (leveraged_pnl_percent / 100)
 
-        with get_cursor() as cur:
-            cur.execute("""
-                UPDATE positions
-                SET current_price          = %s,
-                    unrealized_pnl         = %s,
-                    unrealized_pnl_percent = %s
-                WHERE id = %s
-            """, (current_price, unrealized_pnl, leveraged_pnl_percent, position["id"]))
+        marks.append((position["id"], current_price, unrealized_pnl, leveraged_pnl_percent))
+
+        # Carry this tick's marks on the row so a close records the
+        # at-close unrealized values, not the previous tick's
+        position["unrealized_pnl"] = unrealized_pnl
+        position["unrealized_pnl_percent"] = leveraged_pnl_percent
 
         # Check take profit / stop loss
-        should_close = False
-        close_reason = ""
-
-        if position["direction"] == "long":
-            if current_price >= position["take_profit_price"]:
-                should_close, close_reason = True, "take_profit"
-            elif current_price <= position["stop_loss_price"]:
-                should_close, close_reason = True, "stop_loss"
-        else:  # short
-            if current_price <= position["take_profit_price"]:
-                should_close, close_reason = True, "take_profit"
-            elif current_price >= position["stop_loss_price"]:
-                should_close, close_reason = True, "stop_loss"
-
-        if should_close:
-            closed = close_position(position["id"], current_price, close_reason)
-            if closed:
-                closed_positions.append(closed)
+        if sign * (current_price - position["take_profit_price"]) >= 0:
+            to_close.append((position, current_price, "take_profit"))
+        elif sign * (position["stop_loss_price"] - current_price) >= 0:
+            to_close.append((position, current_price, "stop_loss"))
+
+    if not marks:
+        return []
 
+    # Marks and closes share one connection checkout and transaction:
+    # either the whole tick lands or none of it does
+    closed_positions = []
+    with get_cursor() as cur:
+        # One UPDATE ... FROM (VALUES ...) marks every position to
+        # market, instead of a round-trip per row
+        psycopg2.extras.execute_values(cur, """
+            UPDATE positions
+            SET current_price          = v.price,
+                unrealized_pnl         = v.pnl,
+                unrealized_pnl_percent = v.pnl_percent
+            FROM (VALUES %s) AS v(id, price, pnl, pnl_percent)
+            WHERE positions.id = v.id
+        """, marks)
+
+        if to_close:
+            closed_positions = _close_positions_bulk(cur, to_close)
+
+    if to_close:
+        _invalidate_stats_cache()
     return closed_positions
 
 
-def close_position(position_id: int, close_price: float, reason: str = "manual") -> Optional[dict]:
-    """Close a position and record in history"""
-    with get_cursor() as cur:
-        cur.execute("SELECT * FROM positions WHERE id = %s", (position_id,))
-        row = cur.fetchone()
-        if not row:
-            return None
-        position = _row_to_position(row)
-
-    # Calculate final PnL
-    if position["direction"] == "long":
-        price_change_percent = ((close_price - position["entry_price"]) / position["entry_price"]) * 100
-    else:
-        price_change_percent = ((position["entry_price"] - close_price) / position["entry_price"]) * 100
-
-    leveraged_pnl_percent = price_change_percent * position["leverage"]
-    realized_pnl          = position["margin_used"] * (leveraged_pnl_percent / 100)
-    closed_at             = datetime.utcnow()
-    was_profitable        = realized_pnl > 0
-    hit_target            = reason == "take_profit" and realized_pnl > 0
+# Columns of the bulk history INSERT, in VALUES order
+_HISTORY_COLUMNS = (
+    "id, symbol, direction, entry_price, close_price, current_price, "
+    "leverage, position_size, margin_used, "
+    "take_profit_price, stop_loss_price, confidence, reasoning, "
+    "opened_at, "
+    "unrealized_pnl, unrealized_pnl_percent, "
+    "realized_pnl, realized_pnl_percent, "
+    "close_reason, was_profitable, hit_target"
+)
 
-    with get_cursor() as cur:
-        # Insert into history, delete from positions, update balance — all one transaction
-        cur.execute("""
-            INSERT INTO trade_history
-                (id, symbol, direction, entry_price, close_price, current_price,
-                 leverage, position_size, margin_used,
-                 take_profit_price, stop_loss_price, confidence, reasoning,
-                 opened_at, closed_at,
-                 unrealized_pnl, unrealized_pnl_percent,
-                 realized_pnl, realized_pnl_percent,
-                 close_reason, was_profitable, hit_target)
-            VALUES
-                (%s, %s, %s, %s, %s, %s,
-                 %s, %s, %s,
-                 %s, %s, %s, %s,
-                 %s, %s,
-                 %s, %s,
-                 %s, %s,
-                 %s, %s, %s)
-            RETURNING *
-        """, (
+
+def _close_positions_bulk(cur, entries: list) -> list:
+    """Close several positions on the caller's cursor.
+
+    A TP/SL sweep under /api/execute can close a burst of positions;
+    going through close_position cost three statements per position.
+    This path issues one multi-row INSERT, one DELETE and one aggregated
+    portfolio UPDATE regardless of how many positions close.
+    """
+    rows = []
+    balance_delta = 0.0
+    pnl_delta = 0.0
+    wins = 0
+
+    for position, close_price, reason in entries:
+        sign = 1.0 if position["direction"] == "long" else -1.0
+        price_change_percent = sign * (close_price - position["entry_price"]) / position["entry_price"] * 100
+
+        leveraged_pnl_percent = price_change_percent * position["leverage"]
+        realized_pnl          = position["margin_used"] * (leveraged_pnl_percent / 100)
+        was_profitable        = realized_pnl > 0
+        hit_target            = reason == "take_profit" and realized_pnl > 0
+
+        rows.append((
             position["id"], position["symbol"], position["direction"],
             position["entry_price"], close_price, close_price,
             position["leverage"], position["position_size"], position["margin_used"],
             position["take_profit_price"], position["stop_loss_price"],
             position["confidence"], position["reasoning"],
-            position["opened_at"], closed_at,
+            position["opened_at"],
             position["unrealized_pnl"], position["unrealized_pnl_percent"],
             realized_pnl, leveraged_pnl_percent,
             reason, was_profitable, hit_target
         ))
-        history_record = _row_to_position(cur.fetchone())
+        balance_delta += position["margin_used"] + realized_pnl
+        pnl_delta     += realized_pnl
+        wins          += 1 if was_profitable else 0
+
+    fetched = psycopg2.extras.execute_values(
+        cur,
+        f"INSERT INTO trade_history ({_HISTORY_COLUMNS}) VALUES %s RETURNING *",
+        rows,
+        fetch=True
+    )
+    history_records = fetched
+
+    cur.execute(
+        "DELETE FROM positions WHERE id = ANY(%s)",
+        ([position["id"] for position, _, _ in entries],)
+    )
+
+    cur.execute("""
+        UPDATE portfolio
+        SET balance        = balance + %s,
+            total_trades   = total_trades + %s,
+            total_pnl      = total_pnl + %s,
+            winning_trades = winning_trades + %s,
+            losing_trades  = losing_trades + %s
+        WHERE id = 1
+    """, (balance_delta, len(rows), pnl_delta, wins, len(rows) - wins))
+
+    return history_records
+
+
+# The whole close is one statement: the DELETE feeds both the history
+# INSERT (with the PnL computed in SQL) and the portfolio UPDATE through
+# CTEs, so a manual close costs a single round-trip instead of four.
+_CLOSE_POSITION_SQL = """
+    WITH del AS (
+        DELETE FROM positions WHERE id = %(id)s RETURNING *
+    ), calc AS (
+        SELECT d.*,
+               (CASE WHEN d.direction = 'long'
+                     THEN %(price)s - d.entry_price
+                     ELSE d.entry_price - %(price)s END
+                / d.entry_price * 100 * d.leverage) AS pnl_percent,
+               d.margin_used *
+               (CASE WHEN d.direction = 'long'
+                     THEN %(price)s - d.entry_price
+                     ELSE d.entry_price - %(price)s END
+                / d.entry_price * d.leverage)       AS pnl
+        FROM del d
+    ), ins AS (
+        INSERT INTO trade_history
+            (id, symbol, direction, entry_price, close_price, current_price,
+             leverage, position_size, margin_used,
+             take_profit_price, stop_loss_price, confidence, reasoning,
+             opened_at,
+             unrealized_pnl, unrealized_pnl_percent,
+             realized_pnl, realized_pnl_percent,
+             close_reason, was_profitable, hit_target)
+        SELECT id, symbol, direction, entry_price, %(price)s, %(price)s,
+               leverage, position_size, margin_used,
+               take_profit_price, stop_loss_price, confidence, reasoning,
+               opened_at,
+               unrealized_pnl, unrealized_pnl_percent,
+               pnl, pnl_percent,
+               %(reason)s, pnl > 0, %(reason)s = 'take_profit' AND pnl > 0
+        FROM calc
+        RETURNING *
+    ), upd AS (
+        UPDATE portfolio p
+        SET balance        = p.balance + c.margin_used + c.pnl,
+            total_trades   = p.total_trades + 1,
+            total_pnl      = p.total_pnl + c.pnl,
+            winning_trades = p.winning_trades + (c.pnl > 0)::int,
+            losing_trades  = p.losing_trades + (c.pnl <= 0)::int
+        FROM calc c
+        WHERE p.id = 1
+    )
+    SELECT * FROM ins
+"""
 
-        cur.execute("DELETE FROM positions WHERE id = %s", (position_id,))
 
-        cur.execute("""
-            UPDATE portfolio
-            SET balance        = balance + %s,
-                total_trades   = total_trades + 1,
-                total_pnl      = total_pnl + %s,
-                winning_trades = winning_trades + CASE WHEN %s > 0 THEN 1 ELSE 0 END,
-                losing_trades  = losing_trades  + CASE WHEN %s <= 0 THEN 1 ELSE 0 END
-            WHERE id = 1
-        """, (
-            position["margin_used"] + realized_pnl,
-            realized_pnl,
-            realized_pnl,
-            realized_pnl
-        ))
+def close_position(position_id: int, close_price: float, reason: str = "manual") -> Optional[dict]:
+    """Close a position and record in history (one statement, one round-trip)"""
+    with get_cursor() as cur:
+        cur.execute(_CLOSE_POSITION_SQL, {
+            "id": position_id,
+            "price": close_price,
+            "reason": reason,
+        })
+        row = cur.fetchone()
 
-    return history_record
+    if not row:
+        return None
+    _invalidate_stats_cache()
+    return row
 
 
 def get_performance_stats() -> dict:
-    """Get overall performance statistics"""
-    with get_cursor() as cur:
-        cur.execute("SELECT * FROM portfolio WHERE id = 1")
-        port = dict(cur.fetchone())
-        cur.execute("SELECT COUNT(*) AS cnt FROM positions")
-        open_count = cur.fetchone()["cnt"]
-        cur.execute("SELECT COUNT(*) AS cnt FROM trade_history")
-        history_count = cur.fetchone()["cnt"]
+    """Get overall performance statistics (cached for a few seconds)"""
+    global _stats_cache
+    cached = _stats_cache
+    if cached and time.monotonic() - cached[0] < _STATS_TTL:
+        return cached[1]
 
-    win_rate = 0.0
-    if port["total_trades"] > 0:
-        win_rate = (port["winning_trades"] / port["total_trades"]) * 100
-
-    total_return = ((port["balance"] - port["initial_balance"]) / port["initial_balance"]) * 100
-
-    return {
-        "current_balance":      port["balance"],
-        "initial_balance":      port["initial_balance"],
-        "total_return_percent": total_return,
-        "total_pnl":            port["total_pnl"],
-        "total_trades":         port["total_trades"],
-        "winning_trades":       port["winning_trades"],
-        "losing_trades":        port["losing_trades"],
-        "win_rate":             win_rate,
-        "open_positions":       open_count,
-        "history_count":        history_count,
-    }
+    with get_cursor() as cur:
+        # Counts ride along as scalar subqueries and the derived
+        # percentages are computed in SQL: one round-trip, one row
+        cur.execute("""
+            SELECT p.balance                              AS current_balance,
+                   p.initial_balance,
+                   (p.balance - p.initial_balance) * 100.0
+                       / p.initial_balance                AS total_return_percent,
+                   p.total_pnl,
+                   p.total_trades,
+                   p.winning_trades,
+                   p.losing_trades,
+                   CASE WHEN p.total_trades > 0
+                        THEN p.winning_trades * 100.0 / p.total_trades
+                        ELSE 0.0 END                      AS win_rate,
+                   (SELECT COUNT(*) FROM positions)       AS open_positions,
+                   (SELECT COUNT(*) FROM trade_history)   AS history_count
+            FROM portfolio p
+            WHERE p.id = 1
+        """)
+        stats = dict(cur.fetchone())
+    _stats_cache = (time.monotonic(), stats)
+    return stats
 
 
 def auto_execute_recommendations(recommendations: dict, current_prices: dict) -> list:
-    """Automatically open positions based on advisory recommendations"""
-    opened = []
+    """Automatically open positions based on advisory recommendations.
 
+    Opens happen as one batch: a single existence check for every
+    candidate symbol, one multi-row INSERT, and one balance UPDATE,
+    instead of per-recommendation selects and commits.
+    """
+    candidates = []
     for rec in recommendations.get("recommendations", []):
         if rec.get("action") == "wait":
             continue
@@ -292,26 +399,75 @@ def auto_execute_recommendations(recommendations: dict, current_prices: dict) ->
         if not symbol or symbol not in current_prices:
             continue
 
-        # Check if we already have a position for this symbol
-        with get_cursor() as cur:
-            cur.execute("SELECT id FROM positions WHERE symbol = %s LIMIT 1", (symbol,))
-            if cur.fetchone():
-                continue
-
         current_price = current_prices[symbol].get("price")
         if not current_price:
             continue
 
-        position = open_position(
-            symbol=symbol,
-            direction=rec.get("action", "long"),
-            entry_price=current_price,
-            leverage=min(rec.get("leverage", 1), 10),  # Cap at 10x
-            take_profit_price=rec.get("take_profit_price", current_price * 1.05),
-            stop_loss_price=rec.get("stop_loss_price", current_price * 0.95),
-            confidence=rec.get("confidence", 50),
-            reasoning=rec.get("reasoning", "No reasoning provided")
+        candidates.append((symbol, rec, current_price))
+
+    if not candidates:
+        return []
+
+    with get_cursor() as cur:
+        # One lookup covers the per-recommendation existence checks
+        cur.execute(
+            "SELECT DISTINCT symbol FROM positions WHERE symbol = ANY(%s)",
+            ([symbol for symbol, _, _ in candidates],)
+        )
+        held = {r["symbol"] for r in cur.fetchall()}
+
+        cur.execute("SELECT balance FROM portfolio WHERE id = 1")
+        balance = cur.fetchone()["balance"]
+
+        rows = []
+        total_margin = 0.0
+        for symbol, rec, current_price in candidates:
+            if symbol in held:
+                continue
+
+            # Mirror the sequential sizing: each open draws 10% of the
+            # balance left after the previous one. The advisory schema
+            # allows explicit nulls, so coalesce with `or` - a plain
+            # .get() default would pass None through into NOT NULL
+            # columns and abort the whole batch INSERT.
+            margin_used   = balance * 0.10
+            leverage      = min(rec.get("leverage") or 1, 10)  # Cap at 10x
+            position_size = (margin_used * leverage) / current_price
+
+            rows.append((
+                symbol, rec.get("action", "long"), current_price, current_price,
+                leverage, position_size, margin_used,
+                rec.get("take_profit_price") or current_price * 1.05,
+                rec.get("stop_loss_price") or current_price * 0.95,
+                rec.get("confidence") or 50,
+                rec.get("reasoning") or "No reasoning provided"
+            ))
+            balance      -= margin_used
+            total_margin += margin_used
+            held.add(symbol)  # one position per symbol, even within a batch
+
+        if not rows:
+            return []
+
+        fetched = psycopg2.extras.execute_values(
+            cur,
+            """
+            INSERT INTO positions
+                (symbol, direction, entry_price, current_price, leverage,
+                 position_size, margin_used, take_profit_price, stop_loss_price,
+                 confidence, reasoning)
+            VALUES %s
+            RETURNING *
+            """,
+            rows,
+            fetch=True
+        )
+        opened = fetched
+
+        cur.execute(
+            "UPDATE portfolio SET balance = balance - %s WHERE id = 1",
+            (total_margin,)
         )
-        opened.append(position)
 
+    _invalidate_stats_cache()
     return opened
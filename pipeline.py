@@ -0,0 +1,28 @@
+"""
+Shared agent pipeline - monitor -> analysis -> recommendations
+
+/api/analyze, /api/recommend and /api/execute previously each re-derived
+these stages inline; they now share one implementation (and its caches).
+"""
+from agents.monitor import run_monitor
+from agents.analysis import analyze_market
+from agents.advisory import get_recommendations
+
+
+async def run_analysis_pipeline() -> dict:
+    """Run the monitor and analysis stages and return both results."""
+    monitor_data = await run_monitor()
+    analysis = await analyze_market(monitor_data)
+    return {
+        "monitor": monitor_data,
+        "analysis": analysis
+    }
+
+
+async def run_recommendation_pipeline() -> dict:
+    """Run the full pipeline through trade recommendations."""
+    bundle = await run_analysis_pipeline()
+    bundle["recommendations"] = await get_recommendations(
+        bundle["monitor"], bundle["analysis"]
+    )
+    return bundle